@@ -1,57 +1,104 @@
 
 import click
+import functools
+import stat
 import sys
 import os
+from typing import Optional
 from pathlib import Path
 from pprint import pprint as pp
-from textual import log
 
-from prism.prism import Prism
+from prism.files import FileData
 # from textual.app import App
 
 
+def iter_records(stream, null_sep: bool):
+    """Yield the lines, or null separated names, read from stream.
+
+    The stream is consumed incrementally so a large pipe is never held
+    in memory as one string.
+    """
+    if not null_sep:
+        for line in stream:
+            yield line.rstrip('\n')
+        return
+    remainder = ''
+    while chunk := stream.read(65536):
+        records = (remainder + chunk).split('\x00')
+        remainder = records.pop()
+        yield from records
+    if remainder:
+        yield remainder
+
+
 def parse_stdin(names, null_sep: bool) -> list:
-    names = names.read()
-    split_char = '\x00' if null_sep else '\n'
-    names = names.strip(split_char)  # find appends a null byte to the end of the string
-    names = names.split(split_char)
-    parsed_names = []
-    for i in names:
-        parsed_name = parse_filename(i)
-        if parsed_name:
-            parsed_names.append(parsed_name)
-    return parsed_names
-
-
-def parse_filename(name: str) -> list:
-    file_data: list = name.split(':', 2)
-    file = Path(file_data[0])
-    if file.is_dir():
-        return []
-    file_data[0] = file
+    return [
+        file_data for line in iter_records(names, null_sep)
+        if (file_data := parse_filename(line))
+    ]
+
+
+@functools.lru_cache(maxsize=None)
+def _path_status(path_str: str) -> tuple:
+    """Return (exists, is_dir) for a path using a single stat call.
+
+    grep/rg output repeats the same filename for every match, so the
+    result is cached per path string.
+    """
     try:
-        file_data[1] = int(file_data[1])
-    except IndexError:
-        # if no line number is found, append 0 and an empty
+        st = os.stat(path_str)
+    except (OSError, ValueError):
+        # missing, a symlink loop, unreadable or an embedded NUL,
+        # Path.exists() treats all of these as not existing
+        return (False, False)
+    return (True, stat.S_ISDIR(st.st_mode))
+
+
+@functools.lru_cache(maxsize=None)
+def _normalize_path(path_str: str) -> str:
+    """Normalize a path once, all lines naming the same file share the result.
+
+    Path drops './' and doubled slashes but, unlike os.path.normpath,
+    keeps '..', which could name a different file through a symlink.
+    """
+    return str(Path(path_str))
+
+
+def parse_filename(name: str) -> Optional[FileData]:
+    first = name.find(':')
+    path_str = name if first == -1 else name[:first]
+    if not path_str:
+        # blank line
+        return None
+    exists, is_dir = _path_status(path_str)
+    if is_dir:
+        return None
+    if first == -1:
+        # if no line number is found, use 0 and an empty
         # string since this is probably data from find.
-        file_data.append(0)
-        file_data.append('')
-    except ValueError:
-        return []
-    if not file_data[0].exists():
-        raise click.BadParameter(f"Path '{file_data[0]}' does not exist.")
-    return file_data
+        line_num, match_string = '0', ''
+    else:
+        second = name.find(':', first + 1)
+        if second == -1:
+            line_num, match_string = name[first + 1:], ''
+        else:
+            line_num, match_string = name[first + 1:second], name[second + 1:]
+        if not line_num.isdecimal():
+            return None
+    if not exists:
+        raise click.BadParameter(f"Path '{path_str}' does not exist.")
+    return FileData(_normalize_path(path_str), int(line_num), match_string)
 
 
 CONTEXT_SETTINGS = {
     'help_option_names': ['-h', '--help'],
 }
 @click.command(context_settings=CONTEXT_SETTINGS)
-@click.argument('files', type=click.File(), nargs=-1)
+@click.argument('files', type=click.Path(exists=True, dir_okay=False, allow_dash=True), nargs=-1)
 @click.option('--null/--no-null', '-n/ ', default=False,
               help='Whether or not the filenames are null terminated or space separated.')
 @click.option('--debug-data', is_flag=True)
-def prism(files: str, null: bool, debug_data: bool) -> None:
+def prism(files: tuple, null: bool, debug_data: bool) -> None:
     """View files found with various means, find, rg, grep.
 
     \b
@@ -86,12 +133,10 @@ def prism(files: str, null: bool, debug_data: bool) -> None:
     filenames = []
     #pp(files)
     for f in files:
-        if f.name == '<stdin>':
-            filenames += parse_stdin(f, null)
+        if f == '-':
+            filenames += parse_stdin(click.get_text_stream('stdin'), null)
         else:
-            filenames.append([Path(f.name), 1, ''])
-
-    sys.stdin = open('/dev/tty', 'r')
+            filenames.append(FileData(_normalize_path(f), 1, ''))
 
     if not files:
         raise click.BadParameter('No files found. ')
@@ -99,5 +144,9 @@ def prism(files: str, null: bool, debug_data: bool) -> None:
     if debug_data:
         pp(filenames)
     else:
+        # stdin was used for the file list, textual needs the terminal
+        if not sys.stdin.isatty():
+            sys.stdin = open('/dev/tty', 'r')
+        from prism.prism import Prism
         app = Prism(files=filenames)
         app.run()
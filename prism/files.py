@@ -0,0 +1,34 @@
+"""The parsed matches.
+
+Kept free of rich and textual imports so the cli can use it without
+loading them.
+"""
+import os
+from array import array
+from typing import NamedTuple
+
+
+class FileData(NamedTuple):
+    """One match: the file, the line number and the matched text."""
+    file: str
+    line_num: int
+    match_string: str
+
+
+class FileList:
+    """The matches stored column-wise rather than as one list per match."""
+
+    def __init__(self, files: list) -> None:
+        self.paths: list = [f.file for f in files]
+        self.line_nums: array = array('i', (f.line_num for f in files))
+        self.match_strings: list = [f.match_string for f in files]
+        # split each distinct path once, grep output repeats them a lot
+        splits = {path: os.path.split(path) for path in set(self.paths)}
+        self.parents: list = [splits[path][0] for path in self.paths]
+        self.names: list = [splits[path][1] for path in self.paths]
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def __getitem__(self, index: int) -> FileData:
+        return FileData(self.paths[index], self.line_nums[index], self.match_strings[index])
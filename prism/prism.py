@@ -1,32 +1,255 @@
+import functools
+import mmap
+import operator
 import sys
 import os
-import re
+from array import array
+from typing import Iterator, Optional
 
+from pygments.lexers import get_lexer_by_name
+from pygments.util import ClassNotFound
 from rich.syntax import Syntax
 from rich.traceback import Traceback
 from textual.strip import Strip
 from rich.segment import Segment
 from rich.style import Style
+from rich.text import Text
 
 from textual.scroll_view import ScrollView
+from textual import work
 from textual.app import App, ComposeResult, RenderResult
 from textual.containers import Container, VerticalScroll, Horizontal, ScrollableContainer
 from textual.reactive import var
+from textual.timer import Timer
+from textual.worker import get_current_worker
 # from textual.widgets import DirectoryTree, Footer, Header, Static
 from textual.widget import Widget
 from textual.widgets import Footer, Header, Static, Label, ListItem, ListView
 from pathlib import Path
 import click
 
+from prism.files import FileList
+
+
+# row class names, indexed by row number & 1
+_PARITY = ('even', 'odd')
+
+# lexers already guessed, keyed by file extension
+_LEXER_BY_SUFFIX: dict = {}
+_TEXT_LEXER = get_lexer_by_name('text', stripnl=False, ensurenl=True, tabsize=4)
+
+# files bigger than _HUGE_FILE_BYTES, or with a line longer than
+# _LONG_LINE_CHARS, are shown as plain text, pygments takes seconds on
+# them. Huge files are also only read a window at a time.
+_HUGE_FILE_BYTES = 512 * 1024
+_LONG_LINE_CHARS = 5000
+# files with more lines than this only render the window of lines
+# around the match, windows are aligned blocks of _WINDOW_LINES
+_LONG_FILE_LINES = 5000
+_WINDOW_LINES = 500
+
+
+@functools.lru_cache(maxsize=256)
+def _pretty_path(parent: str, name: str) -> str:
+    """The styled title for a file, built once per file."""
+    segments = [
+        click.style(f'{parent}/', fg='yellow', dim=True),
+        click.style(name, bold=True),
+    ]
+    return ''.join(segments)
+
+
+class CachedSyntax(Syntax):
+    """A Syntax that keeps its lexed code.
+
+    Rich runs Pygments again on every render. Moving between matches in
+    the same file only changes the highlighted line and the stylized
+    match, so the lexed Text is kept and those are applied to a copy.
+    Only the last KEEP line ranges are kept, a long file is shown in
+    aligned windows (see _window) so nearby matches share one.
+    """
+
+    KEEP = 2
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.lexed: dict = {}
+
+    def lex(self, line_range: Optional[tuple] = None) -> Text:
+        """Lex the code for line_range if that has not been done yet.
+
+        Safe from a worker, a plain Syntax does the lexing so the
+        stylized ranges of this one, which may be on screen, are left
+        alone, and lexed is replaced rather than changed in place.
+        """
+        text = self.lexed.get(line_range)
+        if text is None:
+            plain = Syntax(
+                self.code,
+                self._lexer,
+                theme=self._theme,
+                tab_size=self.tab_size,
+                word_wrap=self.word_wrap,
+                background_color=self.background_color,
+            )
+            text = plain.highlight(self._process_code(self.code)[1], line_range)
+            recent = list(self.lexed.items())[1 - self.KEEP:]
+            self.lexed = dict(recent + [(line_range, text)])
+        return text
+
+    def highlight(self, code: str, line_range: Optional[tuple] = None) -> Text:
+        text = self.lex(line_range).copy()
+        if self._stylized_ranges:
+            self._apply_stylized_ranges(text)
+        return text
+
+
+@functools.lru_cache(maxsize=32)
+def _load_syntax(path: str, mtime_ns: int, size: int) -> CachedSyntax:
+    """Read a file and build the Syntax used to display it.
+
+    The modification time and size are part of the cache key so an
+    edited file is read again. The returned Syntax is shared, callers
+    reset its highlighting before use.
+    """
+    code = Path(path).read_text(encoding='utf-8')
+    suffix = os.path.splitext(path)[1]
+    # line lengths from the line start offsets, without splitting the code
+    starts = _line_starts(code)
+    longest = max(map(operator.sub, starts[1:], starts), default=1) - 1
+    longest = max(longest, len(code) - starts[-1])
+    if longest > _LONG_LINE_CHARS:
+        lexer = _TEXT_LEXER
+    else:
+        lexer = _LEXER_BY_SUFFIX.get(suffix)
+    if lexer is None:
+        # pass Syntax a Lexer instance, given a name it looks the lexer
+        # up again every time it is used
+        try:
+            lexer = get_lexer_by_name(
+                Syntax.guess_lexer(path, code=code),
+                stripnl=False,
+                ensurenl=True,
+                tabsize=4,
+            )
+        except ClassNotFound:
+            lexer = _TEXT_LEXER
+        if suffix:
+            _LEXER_BY_SUFFIX[suffix] = lexer
+    return CachedSyntax(
+        code,
+        lexer,
+        line_numbers=True,
+        word_wrap=True,
+        indent_guides=False,
+        theme="github-dark",
+    )
+
+
+@functools.lru_cache(maxsize=8)
+def _byte_line_starts(path: str, mtime_ns: int, size: int) -> array:
+    """Byte offsets of the start of each line in a file, found via mmap."""
+    starts = array('Q', [0])
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        pos = mm.find(b'\n')
+        while pos != -1:
+            starts.append(pos + 1)
+            pos = mm.find(b'\n', pos + 1)
+    return starts
+
+
+@functools.lru_cache(maxsize=8)
+def _load_window(path: str, mtime_ns: int, size: int, first: int, last: int) -> CachedSyntax:
+    """Build a plain text Syntax of lines first to last of a large file.
+
+    Only those lines are decoded. Huge files are not lexed (see
+    _HUGE_FILE_BYTES), so starting part way through the file cannot
+    confuse the colouring.
+    """
+    starts = _byte_line_starts(path, mtime_ns, size)
+    begin = starts[min(first, len(starts)) - 1]
+    end = starts[last] if last < len(starts) else size
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        code = mm[begin:end].decode('utf-8').replace('\r\n', '\n')
+    return CachedSyntax(
+        code,
+        _TEXT_LEXER,
+        line_numbers=True,
+        start_line=first,
+        word_wrap=True,
+        indent_guides=False,
+        theme="github-dark",
+    )
+
+
+@functools.lru_cache(maxsize=32)
+def _line_starts(code: str) -> array:
+    """Offsets of the start of each line in code.
+
+    Cached on the code string itself, which is the same object for as
+    long as _load_syntax keeps the file cached.
+    """
+    starts = array('L', [0])
+    pos = code.find('\n')
+    while pos != -1:
+        starts.append(pos + 1)
+        pos = code.find('\n', pos + 1)
+    return starts
+
+
+def _window(line_num: int) -> tuple:
+    """The first and last line shown around line_num in a long file.
+
+    Windows are aligned to _WINDOW_LINES so nearby matches share one.
+    """
+    first = max(1, (line_num - 1) // _WINDOW_LINES * _WINDOW_LINES + 1 - _WINDOW_LINES)
+    return (first, first + 3 * _WINDOW_LINES - 1)
+
+
+def _nth_line(code: str, n: int) -> str:
+    """Return line n (1 based) of code without splitting all of it."""
+    starts = _line_starts(code)
+    if n > len(starts):
+        return ''
+    start = starts[max(n, 1) - 1]
+    end = code.find('\n', start)
+    return code[start:] if end == -1 else code[start:end]
+
 
 class FileListItem(ListItem):
-    def __init__(self, file_item: list, classname: str) -> None:
+    __slots__ = ('files', 'index', 'classname', 'label_text')
+    # shared by every row, a style string would be parsed per span
+    PARENT_STYLE = Style(bold=True, color='blue')
+    NAME_STYLE = Style(bold=True, color='bright_white')
+    LINE_NUM_STYLE = Style(color='green')
+
+    def __init__(self, files: FileList, index: int, classname: str) -> None:
         super().__init__()
-        self.file: Path = file_item[0]
-        self.line_num: int = int(file_item[1])
-        self.match_string: str = file_item[2]
+        # the match data stays in the FileList columns, this is a view of row index
+        self.files: FileList = files
+        self.index: int = index
         # self.highlight_range = (self.line_num, 0), (self.line_num, 1000)
         self.classname: str = classname
+        # built as Text up front so no markup is parsed when rendering
+        parent = files.parents[index]
+        self.label_text: Text = Text.assemble(
+            (f'{parent}/' if parent else '', self.PARENT_STYLE),
+            (files.names[index], self.NAME_STYLE),
+            ' ',
+            (str(self.line_num), self.LINE_NUM_STYLE),
+        )
+
+    @property
+    def file(self) -> str:
+        return self.files.paths[self.index]
+
+    @property
+    def line_num(self) -> int:
+        return self.files.line_nums[self.index]
+
+    @property
+    def match_string(self) -> str:
+        return self.files.match_strings[self.index]
 
     # def get_highlight_range(self):
     #     return (self.line_num, 0), (self.line_num, 1000)
@@ -35,11 +258,8 @@ class FileListItem(ListItem):
         # see https://textual.textualize.io/guide/widgets/#segment-and-style
         # line_number = f' [bright_black]{self.line_num}[/]' if self.line_num else ''
 
-        parent = ''
-        if len(self.file.parts) > 1:
-            parent = f'[b blue]{self.file.parent}/[/]'
         yield Label(
-            f'{parent}[b bright_white]{self.file.name}[/] [green]{self.line_num}[/]',
+            self.label_text,
             classes=''
         )
 
@@ -48,6 +268,46 @@ class FileListItem(ListItem):
         #     yield Label(f'{self.file.parent}/', classes='path', expand=True, shrink=True)
 
 
+class FileListView(ListView):
+    """A ListView that creates its FileListItems in batches.
+
+    Only the first batch is built up front, the rest are mounted as the
+    list is scrolled towards the end. A batch is a few screens worth of
+    rows so the first frame does not wait on the whole result set.
+    """
+
+    SCREENS_PER_BATCH = 3
+
+    def __init__(self, files: FileList, **kwargs) -> None:
+        self.files = files
+        self.batch_size = max(self.app.size.height, 1) * self.SCREENS_PER_BATCH
+        self.loaded = min(len(files), self.batch_size)
+        super().__init__(*self.make_items(0, self.loaded), **kwargs)
+
+    def make_items(self, start: int, end: int) -> Iterator[FileListItem]:
+        return (
+            FileListItem(self.files, i, _PARITY[i & 1])
+            for i in range(start, end)
+        )
+
+    def load_more(self) -> None:
+        start = self.loaded
+        self.loaded = min(len(self.files), start + self.batch_size)
+        self.extend(self.make_items(start, self.loaded))
+
+    def check_load_more(self) -> None:
+        """Mount the next batch if the end of the list is in view."""
+        if self.loaded < len(self.files) and self.scroll_y >= self.max_scroll_y - self.size.height:
+            self.load_more()
+
+    def watch_scroll_y(self, old_value: float, new_value: float) -> None:
+        super().watch_scroll_y(old_value, new_value)
+        self.check_load_more()
+
+    def on_resize(self) -> None:
+        self.check_load_more()
+
+
 class Prism(App):
     """View files found."""
 
@@ -57,11 +317,15 @@ class Prism(App):
         ("q", "quit", "Quit"),
     ]
     ENABLE_COMMAND_PALETTE = False
+    HIGHLIGHT_STYLE = Style(color='bright_white', bgcolor='green')
+    # seconds to wait for the cursor to settle before rendering a file
+    HIGHLIGHT_DELAY = 0.04
 
     show_files = var(True)
 
     def __init__(self, files):
-        self.files = files
+        self.files = FileList(files)
+        self.highlight_timer: Optional[Timer] = None
         super().__init__()
 
     def watch_show_files(self, show_files: bool) -> None:
@@ -71,71 +335,98 @@ class Prism(App):
     def compose(self) -> ComposeResult:
         """Compose our UI."""
 
-        self.log(self.files)
-        items = []
-        for i, ele in enumerate(self.files):
-            classname = 'odd' if i % 2 else 'even'
-            items.append(
-                FileListItem(ele, classname)
-            )
-
         yield Header()
         with Container():
-            yield ListView(*items, id='file-list')
+            yield FileListView(self.files, id='file-list')
             with VerticalScroll(id="code-view"):
                 yield Static(id="code", expand=True)
         yield Footer()
 
-    def pretty_path(self, f):
-
-        segments = [
-            click.style(f'{f.parent}/', fg='yellow', dim=True),
-            click.style(f.name, bold=True),
-        ]
-        return ''.join(segments)
+    def pretty_path(self, item: FileListItem) -> str:
+        return _pretty_path(item.files.parents[item.index] or '.', item.files.names[item.index])
 
     def on_mount(self) -> None:
+        # looked up once, the highlight handlers use these on every move
+        self.code_view = self.query_one("#code", Static)
+        self.code_scroll = self.query_one("#code-view", VerticalScroll)
         self.query_one(ListView).focus()
         self.title = ''
 
     def on_list_view_highlighted(
             self, event: ListView.Highlighted) -> None:
-        line_num = event.item.line_num
         event.stop()
-        code_view = self.query_one("#code", Static)
-        try:
-            syntax = Syntax.from_path(
-                str(event.item.file),
-                line_numbers=True,
-                word_wrap=True,
-                indent_guides=False,
-                theme="github-dark",
-                highlight_lines={line_num},
-            )
+        # holding a cursor key highlights every row on the way, only
+        # the row the cursor stops on gets rendered
+        if self.highlight_timer is not None:
+            self.highlight_timer.stop()
+        self.highlight_timer = self.set_timer(
+            self.HIGHLIGHT_DELAY, functools.partial(self.show_item, event.item)
+        )
 
-            line = syntax.code.splitlines()[line_num - 1]
-            match = re.search(event.item.match_string, line)
-            pos = match.span()
-            # self.log(event.item.match_string)
-            # self.log(match.string)
-            # self.log(line.replace(' ', 'x'))
-            # self.log('-' * match.start())
-            # self.log(match.start(), match.end(), match.span())
+    def line_range(self, syntax: Syntax, line_num: int) -> Optional[tuple]:
+        """The lines of syntax to render, only those around the match of a long file."""
+        if len(_line_starts(syntax.code)) > _LONG_FILE_LINES:
+            return _window(line_num)
+        return None
 
-            highlight = Style(color='bright_white', bgcolor='green')
-            syntax.stylize_range(highlight, (line_num, pos[0]), (line_num, pos[1]))
+    def show_item(self, item: FileListItem) -> None:
+        """Show the file for item with its match highlighted."""
+        self.highlight_timer = None
+        self.load_item(item)
 
+    @work(exclusive=True, thread=True)
+    def load_item(self, item: FileListItem) -> None:
+        """Read and lex the file for item off the UI thread."""
+        path = item.file
+        try:
+            st = os.stat(path)
+            if st.st_size > _HUGE_FILE_BYTES:
+                first, last = _window(item.line_num)
+                syntax = _load_window(path, st.st_mtime_ns, st.st_size, first, last)
+            else:
+                syntax = _load_syntax(path, st.st_mtime_ns, st.st_size)
+            # lex here too, the first render would do it on the UI thread
+            syntax.lex(self.line_range(syntax, item.line_num))
         except Exception:
-            code_view.update(Traceback(theme="github-dark", width=None))
-            self.title = "ERROR"
+            error = Traceback(theme="github-dark", width=None)
+            if not get_current_worker().is_cancelled:
+                self.call_from_thread(self.show_error, error)
         else:
-            code_view.update(syntax)
-            scroll_offset = self.size.height // 3
-            self.query_one("#code-view").scroll_to(
-                y=int(event.item.line_num) - scroll_offset,
-                animate=False,
-            )
-            self.title = self.pretty_path(event.item.file)  #str(event.item.file)
+            if not get_current_worker().is_cancelled:
+                self.call_from_thread(self.show_syntax, item, syntax)
+
+    def show_error(self, error: Traceback) -> None:
+        self.code_view.update(error)
+        self.title = "ERROR"
+
+    def show_syntax(self, item: FileListItem, syntax: Syntax) -> None:
+        line_num = item.line_num
+        # a window of a large file starts at start_line, row is the
+        # line's position within syntax.code
+        first_line = syntax.start_line
+        row = line_num - first_line + 1
+        # drop the highlighting left from the last match shown in this file
+        syntax.highlight_lines = {line_num}
+        syntax._stylized_ranges.clear()
+        syntax.line_range = self.line_range(syntax, line_num)
+        if syntax.line_range is not None:
+            first_line = syntax.line_range[0]
+
+        line = _nth_line(syntax.code, row)
+        # the match string is literal text, not a regex
+        match_string = item.match_string
+        start = line.find(match_string)
+        if match_string and start != -1:
+            end = start + len(match_string)
+            syntax.stylize_range(self.HIGHLIGHT_STYLE, (row, start), (row, end))
+
+        self.code_view.update(syntax)
+        scroll_offset = self.size.height // 3
+        self.code_scroll.scroll_to(
+            y=line_num - first_line + 1 - scroll_offset,
+            animate=False,
+        )
+        self.title = self.pretty_path(item)  #str(item.file)
 
     def action_toggle_files(self) -> None:
         """Called in response to key binding."""